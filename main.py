@@ -1,10 +1,21 @@
+import os
 import streamlit as st
 from typing import Optional
 
-from src.db import Database
+from src.db import DB_PATH, get_db
 from src.llm import analyze_competition
 from src.services import scrape_and_store_product, fetch_and_store_competitors
 
+# Entries for older mtimes are never hit again, so keep the caches small
+@st.cache_data(max_entries=32)
+def load_products_page(offset: int, limit: int, mtime: float) -> list[dict]:
+    # mtime is only the cache key: a write to the DB file invalidates the cached page
+    return get_db().get_products_page(offset, limit)
+
+@st.cache_data(max_entries=4)
+def count_products(mtime: float) -> int:
+    return get_db().count_products()
+
 def render_header() -> None:
     st.title("🛒 Amazon Competitor Analysis (Egypt Edition)")
     st.caption("Advanced scraping and analysis tool using Oxylabs, TinyDB, and LangChain")
@@ -26,6 +37,33 @@ def render_inputs() -> tuple[str, str, str]:
         
     return asin.strip(), geo.strip(), domain
 
+INVENTORY_COLUMNS = ("asin", "title", "price", "currency", "brand", "stock", "url")
+
+def render_inventory_table(products: list[dict], key: str) -> Optional[dict]:
+    """Render a page of products as one table and return the selected product, if any."""
+    rows = []
+    for p in products:
+        row = {k: p.get(k) for k in INVENTORY_COLUMNS}
+        images = p.get("images") or []
+        row["image"] = images[0] if images else None
+        rows.append(row)
+
+    event = st.dataframe(
+        rows,
+        column_config={
+            "url": st.column_config.LinkColumn("Link", display_text="View on Amazon"),
+            "image": st.column_config.ImageColumn("Image"),
+            "price": st.column_config.NumberColumn("Price", format="%.2f"),
+        },
+        use_container_width=True,
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=key,
+    )
+    selected_rows = event.selection.rows
+    return products[selected_rows[0]] if selected_rows else None
+
 def render_product_card(product: dict) -> None:
     with st.container(border=True):
         cols = st.columns([1, 2])
@@ -69,10 +107,11 @@ def main() -> None:
     asin, geo, domain = render_inputs()
 
     # Scrape Action
+    force_scrape = st.checkbox("Force re-scrape", help="Ignore product data scraped within the last hour")
     if st.button("Scrape Product Details", type="primary") and asin:
         with st.spinner(f"Scraping {asin} from amazon.{domain}..."):
             try:
-                scrape_and_store_product(asin=asin, geo_location=geo, domain=domain)
+                scrape_and_store_product(asin=asin, geo_location=geo, domain=domain, force_refresh=force_scrape)
                 st.success(f"Product {asin} saved to local database.")
                 # Reset analysis view if a new product is scraped
                 if "analyzing_asin" in st.session_state:
@@ -80,27 +119,30 @@ def main() -> None:
             except Exception as e:
                 st.error(f"Scraping failed: {str(e)}")
 
-    # Database Display
-    db = Database()
-    products = db.get_all_products()
+    # Database Display (get_db() also creates the DB file on first run)
+    db = get_db()
+    db_mtime = os.path.getmtime(DB_PATH)
+    total_products = count_products(db_mtime)
     
-    if products:
+    if total_products:
         st.divider()
         st.subheader("📋 Your Scraped Inventory")
         
         # Pagination settings
         items_per_page = 5
-        total_pages = max((len(products) + items_per_page - 1) // items_per_page, 1)
+        total_pages = max((total_products + items_per_page - 1) // items_per_page, 1)
         
         col_p1, col_p2, col_p3 = st.columns([4, 1, 4])
         with col_p2:
             page = st.number_input("Page", min_value=1, max_value=total_pages, value=1) - 1
             
         start_idx = page * items_per_page
-        end_idx = min(start_idx + items_per_page, len(products))
         
-        for p in products[start_idx:end_idx]:
-            render_product_card(p)
+        page_products = load_products_page(start_idx, items_per_page, db_mtime)
+        st.caption("Select a row to see product details and analyze its competitors.")
+        selected_product = render_inventory_table(page_products, key=f"inventory_page_{page}")
+        if selected_product:
+            render_product_card(selected_product)
 
     # Competitor Analysis Section
     selected_asin: Optional[str] = st.session_state.get("analyzing_asin")
@@ -108,7 +150,6 @@ def main() -> None:
         st.divider()
         st.subheader(f"🔍 Competition Deep-Dive: {selected_asin}")
         
-        db = Database()
         existing_comps = db.search_products({"parent_asin": selected_asin})
         
         if not existing_comps:
@@ -132,13 +173,15 @@ def main() -> None:
                         domain=domain,
                         geo_location=geo,
                         pages=2,
+                        force_refresh=True,
                     )
                     st.rerun()
         
         with act_col1:
+            force_refresh = st.checkbox("Force refresh", help="Ignore the cached analysis and ask the LLM again")
             if st.button("🤖 Run AI Price Analysis", type="primary"):
                 with st.spinner("LLM is processing market trends..."):
-                    analysis_text = analyze_competition(parent_asin=selected_asin)
+                    analysis_text = analyze_competition(parent_asin=selected_asin, force_refresh=force_refresh)
                     st.info("AI Analysis Result:")
                     st.markdown(analysis_text)
 
@@ -1,34 +1,118 @@
+import streamlit as st
 from tinydb import TinyDB, Query
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
+from collections import defaultdict
+from itertools import islice
 from datetime import datetime
 import os
 
 
+# Fields kept in an in-memory {value: [doc_id, ...]} index for equality lookups
+INDEXED_FIELDS = ("asin", "parent_asin")
+
+DB_PATH = "data.json"
+
+
 class Database:
-    def __init__(self, db_path: str = "data.json"):
+    def __init__(self, db_path: str = DB_PATH):
         # Create data directory if db_path has a directory component
         dirname = os.path.dirname(db_path)
         if dirname:
             os.makedirs(dirname, exist_ok=True)
         self.db = TinyDB(db_path)
         self.products = self.db.table('products')
+        self.analyses = self.db.table('analyses')
+        self._rebuild_indexes()
+
+    def _rebuild_indexes(self) -> None:
+        """Scan the products table once and rebuild the equality indexes."""
+        self._indexes: Dict[str, Dict[Any, List[int]]] = {
+            field: defaultdict(list) for field in INDEXED_FIELDS
+        }
+        for doc in self.products:
+            self._index_document(doc.doc_id, doc)
+
+    def _index_document(self, doc_id: int, doc: Dict[str, Any]) -> None:
+        for field, index in self._indexes.items():
+            value = doc.get(field)
+            if isinstance(value, str):
+                index[value].append(doc_id)
+
+    def _indexed_doc_ids(self, search_criteria: Dict[str, Any]) -> Optional[List[int]]:
+        """Doc ids matching the indexed part of the criteria, or None if no field is indexed."""
+        doc_ids = None
+        for key, value in search_criteria.items():
+            if key not in self._indexes:
+                continue
+            ids = self._indexes[key].get(value, [])
+            doc_ids = ids if doc_ids is None else [i for i in doc_ids if i in ids]
+        return doc_ids
 
     def insert_product(self, product_data: Dict[str, Any]) -> int:
         """Insert a new product into the database."""
         product_data['created_at'] = datetime.now().isoformat()
-        return self.products.insert(product_data)
+        doc_id = self.products.insert(product_data)
+        self._index_document(doc_id, product_data)
+        return doc_id
 
     def get_product(self, asin: str) -> Optional[Dict[str, Any]]:
         """Get a product by its ASIN."""
-        Product = Query()
-        return self.products.get(Product.asin == asin)
+        doc_ids = self._indexes["asin"].get(asin)
+        return self.products.get(doc_id=doc_ids[0]) if doc_ids else None
 
     def get_all_products(self) -> List[Dict[str, Any]]:
         """Get all products from the database."""
         return self.products.all()
 
+    def get_products_page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Get a single page of products without materializing the whole table."""
+        return list(islice(self.products, offset, offset + limit))
+
+    def count_products(self) -> int:
+        """Get the total number of stored products."""
+        return len(self.products)
+
+    def search_projection(
+        self, search_criteria: Dict[str, Any], fields: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        """Like search_products, but only keep the given fields of each match."""
+        fields = tuple(fields)
+        return [
+            {k: doc[k] for k in fields if k in doc}
+            for doc in self.search_products(search_criteria)
+        ]
+
+    def get_analysis(self, parent_asin: str, key: str) -> Optional[Dict[str, Any]]:
+        """Get the stored LLM analysis for a product if it was made for this input hash."""
+        Analysis = Query()
+        cached = self.analyses.get(Analysis.parent_asin == parent_asin)
+        return cached if cached and cached.get("key") == key else None
+
+    def save_analysis(self, parent_asin: str, key: str, analysis_text: str) -> None:
+        """Store the LLM analysis for a product, replacing its previous one."""
+        Analysis = Query()
+        # One row per product, so changing inputs never pile up rows in the DB file
+        self.analyses.upsert(
+            {
+                "parent_asin": parent_asin,
+                "key": key,
+                "analysis_text": analysis_text,
+                "created_at": datetime.now().isoformat(),
+            },
+            Analysis.parent_asin == parent_asin,
+        )
+
     def search_products(self, search_criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Search products based on criteria (e.g., {"parent_asin": "B123"})."""
+        doc_ids = self._indexed_doc_ids(search_criteria)
+        if doc_ids is not None:
+            if not doc_ids:
+                return []
+            return [
+                doc for doc in self.products.get(doc_ids=doc_ids)
+                if all(doc.get(key) == value for key, value in search_criteria.items())
+            ]
+
         Product = Query()
         query = None
         for key, value in search_criteria.items():
@@ -36,4 +120,10 @@ class Database:
                 query = (Product[key] == value)
             else:
                 query &= (Product[key] == value)
-        return self.products.search(query) if query else []
\ No newline at end of file
+        return self.products.search(query) if query else []
+
+
+@st.cache_resource
+def get_db() -> Database:
+    """Shared Database instance reused across Streamlit reruns and sessions."""
+    return Database()
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+from datetime import datetime, timedelta
 from typing import List, Optional
 
 from pydantic import BaseModel, Field
-from src.db import Database
+from src.db import Database, get_db
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,74 +29,105 @@ class AnalysisOutput(BaseModel):
     recommendations: List[str]
 
 
-def _format_competitors(db: Database, parent_asin: str) -> List[dict]:
-    comps = db.search_products({"parent_asin": parent_asin})
+LLM_MODEL = "gpt-4o-mini"
+LLM_MAX_CONCURRENCY = 8
+# Keep the prompt small: only the closest competitors, with shortened titles
+MAX_PROMPT_COMPETITORS = 10
+MAX_PROMPT_TITLE_LENGTH = 80
+PROMPT_COMPETITOR_FIELDS = ("asin", "title", "price", "currency", "rating")
+ANALYSIS_CACHE_TTL_SECONDS = 24 * 3600
+
+ANALYSIS_PROMPT_TEMPLATE = (
+    "You are a market analyst. Given a product and its competitor list, "
+    "write a concise analysis. Pay attention to currency and pricing context.\n\n"
+    "Product Title: {product_title}\n"
+    "Brand: {brand}\n"
+    "Price: {currency} {price}\n"
+    "Rating: {rating}\n"
+    "Categories: {categories}\n"
+    "Amazon Domain: {amazon_domain}\n\n"
+    "Competitors (JSON): {competitors}\n\n"
+    "IMPORTANT: All prices should be displayed with their correct currency symbol. "
+    "When comparing prices, ensure you're using the same currency context."
+)
+
+
+def _competitor_rank(comp: dict, parent_price: Optional[float]) -> tuple:
+    price = comp.get("price")
+    rating = comp.get("rating")
+    has_price = isinstance(price, (int, float))
+    # Closest price first when the parent price is known, otherwise best rated first
+    if isinstance(parent_price, (int, float)) and has_price:
+        return (0, abs(price - parent_price))
+    return (1, -(rating if isinstance(rating, (int, float)) else 0))
+
+
+def _format_competitors(db: Database, parent_asin: str, parent_price: Optional[float] = None) -> List[dict]:
+    comps = db.search_projection({"parent_asin": parent_asin}, PROMPT_COMPETITOR_FIELDS)
+    unique = {c["asin"]: c for c in comps if "asin" in c}  # refreshes store repeats, keep the latest
+    ranked = sorted(unique.values(), key=lambda c: _competitor_rank(c, parent_price))
     return [
         {
             "asin": c["asin"],
-            "title": c["title"],
-            "price": c["price"],
+            "title": (c.get("title") or "")[:MAX_PROMPT_TITLE_LENGTH],
+            "price": c.get("price"),
             "currency": c.get("currency"),
-            "rating": c["rating"],
-            "amazon_domain": c.get("amazon_domain"),
+            "rating": c.get("rating"),
         }
-        for c in comps
+        for c in ranked[:MAX_PROMPT_COMPETITORS]
     ]
 
 
-def analyze_competition(parent_asin: str) -> str:
-    from langchain_openai import ChatOpenAI
-    from langchain.prompts import PromptTemplate
-    from langchain_core.output_parsers import PydanticOutputParser
-
-    api_key = os.getenv("OPENAI_API_KEY", "").strip()
-    if not api_key:
-        return "Set OPENAI_API_KEY to run LLM analysis."
-
-    db = Database()
+def _build_prompt_input(db: Database, parent_asin: str) -> dict:
     product = db.get_product(parent_asin)
-    competitors = _format_competitors(db, parent_asin)
-
-    parser = PydanticOutputParser(pydantic_object=AnalysisOutput)
-
-    template = (
-        "You are a market analyst. Given a product and its competitor list, "
-        "write a concise analysis. Pay attention to currency and pricing context.\n\n"
-        "Product Title: {product_title}\n"
-        "Brand: {brand}\n"
-        "Price: {currency} {price}\n"
-        "Rating: {rating}\n"
-        "Categories: {categories}\n"
-        "Amazon Domain: {amazon_domain}\n\n"
-        "Competitors (JSON): {competitors}\n\n"
-        "IMPORTANT: All prices should be displayed with their correct currency symbol. "
-        "When comparing prices, ensure you're using the same currency context.\n\n"
-        "{format_instructions}"
-    )
-
-    prompt = PromptTemplate(
-        template=template,
-        input_variables=["product_title", "brand", "price", "currency", "rating", "categories", "amazon_domain", "competitors"],
-        partial_variables={"format_instructions": parser.get_format_instructions()},
+    return {
+        "product_title": product["title"] if product else parent_asin,
+        "brand": product.get("brand") if product else None,
+        "price": product.get("price") if product else None,
+        "currency": product.get("currency") if product else "",
+        "rating": product.get("rating") if product else None,
+        "categories": product.get("categories") if product else None,
+        "amazon_domain": product.get("amazon_domain") if product else "com",
+        "competitors": json.dumps(
+            _format_competitors(db, parent_asin, product.get("price") if product else None),
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ),
+    }
+
+
+_ANALYSIS_SCHEMA = AnalysisOutput.model_json_schema()
+
+
+def _analysis_cache_key(prompt_input: dict) -> str:
+    # Same model, prompt, output schema and input -> same analysis, so it can be served from the DB
+    payload = json.dumps(
+        {
+            "model": LLM_MODEL,
+            "template": ANALYSIS_PROMPT_TEMPLATE,
+            "schema": _ANALYSIS_SCHEMA,
+            "input": prompt_input,
+        },
+        sort_keys=True,
+        default=str,
     )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
 
-    llm = ChatOpenAI(model="gpt-4", temperature=0)
 
-    chain = prompt | llm | parser
+def _get_cached_analysis(db: Database, parent_asin: str, key: str) -> Optional[str]:
+    cached = db.get_analysis(parent_asin, key)
+    if not cached:
+        return None
+    try:
+        created_at = datetime.fromisoformat(cached.get("created_at", ""))
+    except (TypeError, ValueError):
+        return None
+    if datetime.now() - created_at > timedelta(seconds=ANALYSIS_CACHE_TTL_SECONDS):
+        return None
+    return cached.get("analysis_text")
 
-    result: AnalysisOutput = chain.invoke(
-        {
-            "product_title": product["title"] if product else parent_asin,
-            "brand": product.get("brand") if product else None,
-            "price": product.get("price") if product else None,
-            "currency": product.get("currency") if product else "",
-            "rating": product.get("rating") if product else None,
-            "categories": product.get("categories") if product else None,
-            "amazon_domain": product.get("amazon_domain") if product else "com",
-            "competitors": competitors,
-        }
-    )
 
+def _render_analysis(result: AnalysisOutput) -> str:
     # Present as plain text for Streamlit
     lines = [
         "Summary:\n" + result.summary,
@@ -114,3 +148,55 @@ def analyze_competition(parent_asin: str) -> str:
     return "\n".join(lines)
 
 
+def analyze_competition_batch(parent_asins: List[str], force_refresh: bool = False) -> List[str]:
+    """Analyze several products at once, running the LLM requests concurrently.
+
+    Analyses whose inputs have not changed are served from the database
+    unless `force_refresh` is set. Returns one analysis text per ASIN, in
+    the same order as `parent_asins`.
+    """
+    from langchain_openai import ChatOpenAI
+    from langchain.prompts import PromptTemplate
+
+    api_key = os.getenv("OPENAI_API_KEY", "").strip()
+    if not api_key:
+        return ["Set OPENAI_API_KEY to run LLM analysis." for _ in parent_asins]
+
+    db = get_db()
+    inputs = [_build_prompt_input(db, parent_asin) for parent_asin in parent_asins]
+    keys = [_analysis_cache_key(prompt_input) for prompt_input in inputs]
+    texts: List[Optional[str]] = [
+        None if force_refresh else _get_cached_analysis(db, parent_asin, key)
+        for parent_asin, key in zip(parent_asins, keys)
+    ]
+    pending = [i for i, text in enumerate(texts) if text is None]
+    if not pending:
+        return texts
+
+    prompt = PromptTemplate(
+        template=ANALYSIS_PROMPT_TEMPLATE,
+        input_variables=["product_title", "brand", "price", "currency", "rating", "categories", "amazon_domain", "competitors"],
+    )
+
+    # Native JSON-schema output replaces the format-instructions preamble and text parsing
+    llm = ChatOpenAI(model=LLM_MODEL, temperature=0).with_structured_output(AnalysisOutput)
+
+    chain = prompt | llm
+
+    # One failed call must not discard the analyses that already completed
+    results = chain.batch(
+        [inputs[i] for i in pending],
+        config={"max_concurrency": LLM_MAX_CONCURRENCY},
+        return_exceptions=True,
+    )
+    for i, result in zip(pending, results):
+        if isinstance(result, Exception):
+            texts[i] = f"LLM analysis failed: {result}"
+            continue
+        texts[i] = _render_analysis(result)
+        db.save_analysis(parent_asins[i], keys[i], texts[i])
+    return texts
+
+
+def analyze_competition(parent_asin: str, force_refresh: bool = False) -> str:
+    return analyze_competition_batch([parent_asin], force_refresh=force_refresh)[0]
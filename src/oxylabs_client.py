@@ -1,18 +1,123 @@
 from __future__ import annotations
 
+import copy
+import functools
 import json
+import math
 import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+import orjson
 import requests
 import streamlit as st
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 
 
+def _env_float(name: str, default: float) -> float:
+    # A malformed or non-positive value falls back to the default instead of breaking the import
+    try:
+        value = float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
 OXYLABS_BASE_URL = "https://realtime.oxylabs.io/v1/queries"
+OXYLABS_REQUESTS_PER_SECOND = _env_float("OXYLABS_REQUESTS_PER_SECOND", 5.0)
+OXYLABS_MAX_RETRIES = 3
+OXYLABS_BACKOFF_SECONDS = 0.5
+# Longest Retry-After we wait out; a longer one fails the request instead
+OXYLABS_MAX_RETRY_DELAY_SECONDS = 30.0
+# Responses retried in _post_query, so every attempt goes through the rate limiter
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+SCRAPE_MAX_WORKERS = 8
+PRODUCT_CACHE_TTL_SECONDS = 3600
+# A search page is saturated when less than this share of its items is new
+SEARCH_SATURATION_RATIO = 0.1
+
+
+class _TokenBucket:
+    """Thread-safe token bucket used to pace outgoing Oxylabs requests.
+
+    The rate halves whenever Oxylabs answers 429 and creeps back towards the
+    configured rate with every successful request.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = 0.2):
+        self.base_rate = max(rate, min_rate)
+        self.min_rate = min_rate
+        self.rate = self.base_rate
+        self.capacity = capacity if capacity is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self, delay: float) -> None:
+        """Slow down after a 429 and hold every caller back for at least `delay` seconds."""
+        with self.lock:
+            self._refill()
+            self.rate = max(self.rate / 2, self.min_rate)
+            # Going into token debt makes the next acquire() wait out the delay
+            self.tokens = min(self.tokens, 1 - delay * self.rate)
+
+    def relax(self) -> None:
+        """Recover part of the configured rate after a successful request."""
+        with self.lock:
+            if self.rate < self.base_rate:
+                self._refill()
+                self.rate = min(self.rate * 1.25, self.base_rate)
+
+
+_rate_limiter = _TokenBucket(OXYLABS_REQUESTS_PER_SECOND)
+
+
+def _build_session() -> requests.Session:
+    """Create a pooled session so TCP/TLS connections are reused across queries."""
+    session = requests.Session()
+    # Only connection failures are retried here; HTTP status retries happen in
+    # _post_query so they are paced by the rate limiter.
+    retry = Retry(
+        total=OXYLABS_MAX_RETRIES,
+        connect=OXYLABS_MAX_RETRIES,
+        read=0,
+        status=0,
+        backoff_factor=OXYLABS_BACKOFF_SECONDS,
+        allowed_methods=frozenset({"POST"}),
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry))
+    session.auth = (
+        os.getenv("OXYLABS_USERNAME", "").strip(),
+        os.getenv("OXYLABS_PASSWORD", "").strip(),
+    )
+    return session
+
+
+_SESSION = _build_session()
 
 
 def _extract_content(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -27,36 +132,57 @@ def _extract_content(payload: Dict[str, Any]) -> Dict[str, Any]:
     return payload
 
 
+# Fields copied verbatim from the Oxylabs product content
+_PRODUCT_FIELDS = ("asin", "url", "brand", "price", "stock", "title", "rating", "currency")
+# Copied verbatim too, but default to a fresh empty list when missing
+_PRODUCT_LIST_FIELDS = ("images", "buybox", "product_overview")
+
+
 def _normalize_product(content: Dict[str, Any]) -> Dict[str, Any]:
-    # Get main category path
-    category_path = []
-    if content.get("category_path"):
-        category_path = [cat.strip() for cat in content["category_path"] if cat]
+    get = content.get
+    normalized = {field: get(field) for field in _PRODUCT_FIELDS}
+    for field in _PRODUCT_LIST_FIELDS:
+        normalized[field] = get(field, [])
 
-    return {
-        "asin": content.get("asin"),
-        "url": content.get("url"),
-        "brand": content.get("brand"),
-        "price": content.get("price"),
-        "stock": content.get("stock"),
-        "title": content.get("title"),
-        "rating": content.get("rating"),
-        "images": content.get("images", []),
-        "categories": content.get("category", []) or content.get("categories", []),
-        "category_path": category_path,
-        "currency": content.get("currency"),
-        "buybox": content.get("buybox", []),
-        "product_overview": content.get("product_overview", []),
-    }
+    # Fields that need more than a plain copy
+    normalized["categories"] = get("category", []) or get("categories", [])
+    strip = str.strip
+    normalized["category_path"] = [strip(cat) for cat in get("category_path") or () if cat]
+    return normalized
+
+
+def _retry_delay(response: requests.Response, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying, or None when the server asks for too long a pause."""
+    backoff = OXYLABS_BACKOFF_SECONDS * 2 ** attempt
+    try:
+        delay = float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return backoff
+    if math.isnan(delay):
+        return backoff
+    # The limiter is shared by every worker and session, so never let one response stall it for long
+    if delay > OXYLABS_MAX_RETRY_DELAY_SECONDS:
+        return None
+    return max(delay, 0.0)
 
 
 def _post_query(payload: Dict[str, Any]) -> Dict[str, Any]:
-    username = os.getenv("OXYLABS_USERNAME", "").strip()
-    password = os.getenv("OXYLABS_PASSWORD", "").strip()
-    
-    response = requests.post(OXYLABS_BASE_URL, auth=(username, password), json=payload)
+    for attempt in range(OXYLABS_MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        response = _SESSION.post(OXYLABS_BASE_URL, json=payload, timeout=(5, 60))
+        if response.status_code not in _RETRY_STATUSES or attempt == OXYLABS_MAX_RETRIES:
+            break
+        delay = _retry_delay(response, attempt)
+        if delay is None:
+            break
+        if response.status_code == 429:
+            _rate_limiter.throttle(delay)
+        else:
+            time.sleep(delay)
     response.raise_for_status()
-    response_json = response.json()
+    _rate_limiter.relax()
+    # orjson parses the (often several hundred KB) search payloads much faster than stdlib json
+    response_json = orjson.loads(response.content)
     
     return response_json
 
@@ -79,16 +205,36 @@ def scrape_product_details(asin: str, geo_location: str, domain: str) -> Dict[st
     # Add domain and geo_location to track search context
     normalized["amazon_domain"] = domain
     normalized["geo_location"] = geo_location
+    # When the data was fetched from Oxylabs; copies keep it so cache freshness is never reset
+    normalized["scraped_at"] = datetime.now().isoformat()
     return normalized
 
 
+@functools.lru_cache(maxsize=256)
+def _memoized_product_details(asin: str, geo_location: str, domain: str, ttl_bucket: int) -> Dict[str, Any]:
+    # ttl_bucket only takes part in the cache key so entries expire with the TTL window
+    return scrape_product_details(asin=asin, geo_location=geo_location, domain=domain)
+
+
+def scrape_product_details_memoized(
+    asin: str,
+    geo_location: str,
+    domain: str,
+    ttl: int = PRODUCT_CACHE_TTL_SECONDS,
+) -> Dict[str, Any]:
+    """Scrape product details, reusing in-process results for the same (asin, geo, domain)."""
+    bucket = int(time.time() // max(ttl, 1))
+    # Hand out a copy so callers can annotate the result without touching the cache
+    return copy.deepcopy(_memoized_product_details(asin, geo_location, domain, bucket))
+
+
+# Everything after the first " - " or "|" is usually marketing noise
+_TITLE_SEPARATOR_RE = re.compile(r" - |\|")
+
+
 def _clean_search_title(title: str) -> str:
     """Remove common separators from title to get main product name."""
-    if " - " in title:
-        title = title.split(" - ")[0]
-    if "|" in title:
-        title = title.split("|")[0]
-    return title.strip()
+    return _TITLE_SEPARATOR_RE.split(title, maxsplit=1)[0].strip()
 
 
 def _extract_search_results(content: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -136,7 +282,12 @@ def search_competitors(
     pages: int = 1,
     geo_location: str = "",
 ) -> List[Dict[str, Any]]:
-    """Search for competitor products using multiple strategies."""
+    """Search for competitor products using multiple strategies.
+
+    Remaining pages of a strategy are skipped once a page yields mostly
+    already-seen ASINs, and the search stops after two saturated pages in
+    a row.
+    """
     st.write("🔍 Searching for competitors...")
     
     search_title = _clean_search_title(query_title)
@@ -145,8 +296,11 @@ def search_competitors(
     
     # Define search strategies
     strategies = ["featured", "price_asc", "price_desc", "avg_rating"]
+    saturated_streak = 0
     
     for sort_by in strategies:
+        if saturated_streak >= 2:
+            break
         for page in range(1, max(1, pages) + 1):
             # Prepare search request
             payload = {
@@ -168,44 +322,58 @@ def search_competitors(
             items = _extract_search_results(content)
             
             # Process results
+            new = 0
             for item in items:
                 result = _normalize_search_result(item)
                 if result and result["asin"] not in seen_asins:
                     seen_asins.add(result["asin"])
                     results.append(result)
+                    new += 1
             
-            time.sleep(0.3)
+            # Stop paging this strategy once it only repeats what we have
+            if not items or new / len(items) < SEARCH_SATURATION_RATIO:
+                saturated_streak += 1
+                break
+            saturated_streak = 0
     
     st.write(f"✅ Found {len(results)} competitors")
     return results
 
 
-def scrape_multiple_products(asins: List[str], geo_location: str, domain: str) -> List[Dict[str, Any]]:
+def scrape_multiple_products(
+    asins: List[str], geo_location: str, domain: str, force_refresh: bool = False
+) -> List[Dict[str, Any]]:
     st.write("🔍 Scraping competitor details...")
-    products: List[Dict[str, Any]] = []
+    # Filled in completion order, returned in the order of `asins` (search rank)
+    by_asin: Dict[str, Dict[str, Any]] = {}
     
     # Create a progress bar
     progress_text = st.empty()
     progress_bar = st.progress(0)
     total = len(asins)
     
-    for idx, a in enumerate(asins, 1):
-        try:
+    # force_refresh bypasses the in-process memo and always hits Oxylabs
+    scrape = scrape_product_details if force_refresh else scrape_product_details_memoized
+    with ThreadPoolExecutor(max_workers=SCRAPE_MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(scrape, asin=a, geo_location=geo_location, domain=domain): a
+            for a in asins
+        }
+        for idx, future in enumerate(as_completed(futures), 1):
+            a = futures[future]
             # Update progress
-            progress_text.write(f"🔄 Processing competitor {idx}/{total}: {a}")
             progress_bar.progress(idx/total)
-            
-            product = scrape_product_details(asin=a, geo_location=geo_location, domain=domain)
-            products.append(product)
-            progress_text.write(f"✅ Found: {product.get('title', a)}")
-        except Exception as e:
-            progress_text.write(f"❌ Failed to scrape {a}")
-            continue
-        time.sleep(0.3)
+            try:
+                product = future.result()
+                by_asin[a] = product
+                progress_text.write(f"✅ Found ({idx}/{total}): {product.get('title', a)}")
+            except Exception:
+                progress_text.write(f"❌ Failed to scrape {a}")
     
     # Clear progress indicators
     progress_text.empty()
     progress_bar.empty()
     
+    products = [by_asin[a] for a in asins if a in by_asin]
     st.write(f"✅ Successfully scraped {len(products)} out of {total} competitors")
     return products
\ No newline at end of file
@@ -1,20 +1,82 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 
 import streamlit as st
 
-from src.db import Database
+from src.db import Database, get_db
 from src.oxylabs_client import (
+    PRODUCT_CACHE_TTL_SECONDS,
     scrape_product_details,
+    scrape_product_details_memoized,
     search_competitors,
     scrape_multiple_products,
 )
 
 
-def scrape_and_store_product(asin: str, geo_location: str, domain: str) -> Dict[str, Any]:
-    data = scrape_product_details(asin=asin, geo_location=geo_location, domain=domain)
-    db = Database()
+MAX_COMPETITORS = 20
+
+
+def _find_fresh_product(
+    db: Database,
+    asin: str,
+    geo_location: str,
+    domain: str,
+    ttl: int = PRODUCT_CACHE_TTL_SECONDS,
+) -> Optional[Dict[str, Any]]:
+    """Return the newest stored copy of a product scraped within the last `ttl` seconds.
+
+    Freshness is based on `scraped_at`, the time of the Oxylabs call, not on
+    when the copy was stored; rows without it are treated as stale.
+    """
+    cutoff = datetime.now() - timedelta(seconds=ttl)
+    freshest = None
+    for doc in db.search_products({"asin": asin, "amazon_domain": domain, "geo_location": geo_location}):
+        try:
+            scraped_at = datetime.fromisoformat(doc.get("scraped_at", ""))
+        except (TypeError, ValueError):
+            continue
+        if scraped_at >= cutoff and (freshest is None or doc["scraped_at"] > freshest["scraped_at"]):
+            freshest = doc
+    return freshest
+
+
+def _strip_storage_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # scraped_at is kept on purpose so a reused copy does not look newer than its data
+    return {k: v for k, v in doc.items() if k not in ("parent_asin", "created_at")}
+
+
+def scrape_product_details_cached(
+    asin: str,
+    geo_location: str,
+    domain: str,
+    ttl: int = PRODUCT_CACHE_TTL_SECONDS,
+    force_refresh: bool = False,
+) -> Dict[str, Any]:
+    """Get product details from the local database if fresh, otherwise scrape them.
+
+    `force_refresh` skips both cache layers and always scrapes.
+    """
+    if force_refresh:
+        return scrape_product_details(asin=asin, geo_location=geo_location, domain=domain)
+    cached = _find_fresh_product(get_db(), asin, geo_location, domain, ttl)
+    if cached is not None:
+        return _strip_storage_fields(cached)
+    return scrape_product_details_memoized(asin=asin, geo_location=geo_location, domain=domain, ttl=ttl)
+
+
+def scrape_and_store_product(
+    asin: str, geo_location: str, domain: str, force_refresh: bool = False
+) -> Dict[str, Any]:
+    db = get_db()
+    cached = None if force_refresh else _find_fresh_product(db, asin, geo_location, domain)
+    if cached is not None and not cached.get("parent_asin"):
+        # Already stored recently, no need to pay for another scrape
+        return cached.doc_id
+    data = scrape_product_details_cached(
+        asin=asin, geo_location=geo_location, domain=domain, force_refresh=force_refresh
+    )
     return db.insert_product(data)
 
 
@@ -23,9 +85,10 @@ def fetch_and_store_competitors(
     domain: str,
     geo_location: str,
     pages: int = 2,
+    force_refresh: bool = False,
 ) -> List[Dict[str, Any]]:
     # Load parent product details for better search
-    db = Database()
+    db = get_db()
     parent = db.get_product(parent_asin)
     if not parent:
         return []
@@ -42,15 +105,18 @@ def fetch_and_store_competitors(
     if parent.get("category_path"):
         search_categories.extend(str(cat) for cat in parent["category_path"] if cat)
     
-    # Remove duplicates and empty categories
-    search_categories = list(set(
-        cat.strip() 
-        for cat in search_categories 
-        if cat and isinstance(cat, str) and cat.strip()
-    ))
+    # Remove duplicates and empty categories, keeping the original order
+    seen_categories = set()
+    unique_categories = []
+    for cat in search_categories:
+        cat = cat.strip() if isinstance(cat, str) else ""
+        if cat and cat not in seen_categories:
+            seen_categories.add(cat)
+            unique_categories.append(cat)
+    search_categories = unique_categories
     
-    # Search in each category
-    all_results = []
+    # Search in each category, collecting unique ASINs excluding the parent product
+    competitor_asins: Dict[str, None] = {}
     for category in search_categories[:3]:  # Limit to top 3 categories to avoid too many requests
         search_results = search_competitors(
             query_title=parent["title"],
@@ -59,19 +125,33 @@ def fetch_and_store_competitors(
             pages=pages,
             geo_location=search_geo,
         )
-        all_results.extend(search_results)
+        for r in search_results:
+            if r.get("asin") and r.get("asin") != parent_asin:
+                competitor_asins.setdefault(r["asin"])
+        # Later categories could only add ASINs past the scrape cap
+        if len(competitor_asins) >= MAX_COMPETITORS:
+            break
     
-    # Get unique ASINs excluding the parent product
-    competitor_asins = list(set(
-        r.get("asin") for r in all_results 
-        if r.get("asin") and r.get("asin") != parent_asin
-    ))
+    # Reuse competitors scraped recently, only fetch the rest
+    stored_competitors = []
+    product_details = []
+    to_scrape = []
+    for comp_asin in list(competitor_asins)[:MAX_COMPETITORS]:
+        cached = None if force_refresh else _find_fresh_product(db, comp_asin, search_geo, search_domain)
+        if cached is None:
+            to_scrape.append(comp_asin)
+        elif cached.get("parent_asin") == parent_asin:
+            stored_competitors.append(cached)
+        else:
+            product_details.append(_strip_storage_fields(cached))
     
-    # Fetch full details for each competitor using same domain/location
-    product_details = scrape_multiple_products(competitor_asins[:20], geo_location=search_geo, domain=search_domain)  # Limit to top 20 competitors
+    # Fetch full details for each remaining competitor using same domain/location
+    if to_scrape:
+        product_details.extend(scrape_multiple_products(
+            to_scrape, geo_location=search_geo, domain=search_domain, force_refresh=force_refresh
+        ))
     
     # Store competitors with relationship to parent
-    stored_competitors = []
     for comp in product_details:
         comp["parent_asin"] = parent_asin
         db.insert_product(comp)